@@ -2,16 +2,23 @@ import discord
 from discord import app_commands
 import os
 import io
+import time
+import asyncio
 from dotenv import load_dotenv
 import datetime
-from ocr_processor import process_image
-from chart_generator import generate_pie_chart
+from ocr_processor import process_image, process_image_local_first, LOCAL_FIRST_MODE, MODEL_NAME
+from chart_generator import generate_pie_chart, get_history_chart
 import database
+import image_hash
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
+# Discord rate-limits message edits, so progress updates are batched
+PROGRESS_EDIT_INTERVAL = 1.5  # seconds
+PROGRESS_MAX_ITEMS = 15       # Only the latest items are listed while streaming
+
 class ReceiptBot(discord.Client):
     def __init__(self):
         # Intents are still needed for connection, though message content might not be strictly needed for interactions.
@@ -49,6 +56,84 @@ class ReceiptBot(discord.Client):
 
 client = ReceiptBot()
 
+class DuplicateReceiptView(discord.ui.View):
+    """Asks whether to reuse a saved result for a photo we've (nearly) seen before."""
+
+    def __init__(self, user_id):
+        super().__init__(timeout=60)
+        self.user_id = user_id
+        self.use_saved = None
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.user_id
+
+    @discord.ui.button(label="Use saved result", style=discord.ButtonStyle.primary)
+    async def use_saved_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.use_saved = True
+        await interaction.response.defer()
+        self.stop()
+
+    @discord.ui.button(label="Analyze anyway", style=discord.ButtonStyle.secondary)
+    async def analyze_anyway_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.use_saved = False
+        await interaction.response.defer()
+        self.stop()
+
+def build_result(data, title_prefix="Processed Receipt"):
+    """Builds the summary text and chart files for a parsed receipt."""
+    items = data.get('items', [])
+    total = sum(item['price'] for item in items)
+    item_count = len(items)
+    merchant = data.get('merchant', 'Unknown Merchant')
+    currency = data.get('currency', 'USD')
+
+    # Currency symbol mapping for summary
+    currency_symbols = {'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥', 'CNY': '¥', 'KRW': '₩'}
+    symbol = currency_symbols.get(currency.upper(), currency + " ")
+
+    # Get date from receipt, fallback to today's date if missing
+    date_str = data.get('date')
+    if not date_str or date_str == 'Unknown Date': # Handle both None and prompt default if any
+        date_str = datetime.datetime.now().strftime('%Y-%m-%d')
+
+    chart_title = f"{merchant} Expense Breakdown - {date_str}"
+
+    summary = (
+        f"**{title_prefix}**\n"
+        f"Found {item_count} items. Total: **{symbol}{total:.2f}**\n"
+    )
+
+    # Chart
+    chart_buf = generate_pie_chart(items, title=chart_title, currency=currency)
+
+    files_to_send = []
+    if chart_buf:
+        files_to_send.append(discord.File(chart_buf, filename="expense_chart.png"))
+
+    return summary, files_to_send
+
+def render_progress(data):
+    """Formats a partially parsed receipt for the in-progress message."""
+    lines = ["**Reading receipt...**"]
+    routing = data.get('routing', {})
+    if routing.get('tier'):
+        # An earlier model's result failed validation and the stream restarted
+        lines.append(f"_Double-checking with {routing['model']}..._")
+    if data.get('merchant'):
+        lines.append(f"Merchant: **{data['merchant']}**" + (f" ({data['date']})" if data.get('date') else ""))
+
+    items = data.get('items', [])
+    if len(items) > PROGRESS_MAX_ITEMS:
+        lines.append(f"_...{len(items) - PROGRESS_MAX_ITEMS} earlier items_")
+    for item in items[-PROGRESS_MAX_ITEMS:]:
+        try:
+            lines.append(f"- {str(item['name'])[:40]}: {float(item['price']):.2f}")
+        except (TypeError, ValueError):
+            continue
+    lines.append(f"_{len(items)} items so far_")
+
+    return "\n".join(lines)[:2000]  # Discord message limit
+
 @client.tree.command(name="analyze", description="Upload a receipt image for analysis")
 @app_commands.describe(receipt="The receipt image to analyze")
 async def analyze(interaction: discord.Interaction, receipt: discord.Attachment):
@@ -63,55 +148,135 @@ async def analyze(interaction: discord.Interaction, receipt: discord.Attachment)
     try:
         # 1. Download image
         image_bytes = await receipt.read()
-        
-        # 2. Process with Gemini
-        data = process_image(image_bytes)
+
+        # 2. Check for a near-duplicate photo before spending an API call
+        try:
+            photo_hash = await asyncio.to_thread(image_hash.phash, image_bytes)
+        except Exception as e:
+            print(f"Could not hash image: {e}")
+            photo_hash = None
+
+        status_msg = None  # Message that shows progress; the deferred response unless we already replied
+        # The first lookup loads every stored hash from SQLite, so keep it off the event loop too
+        duplicate = await asyncio.to_thread(image_hash.find_duplicate, photo_hash) if photo_hash is not None else None
+        if duplicate:
+            saved = database.get_receipt(duplicate[0])
+            if saved and saved.get('items'):
+                view = DuplicateReceiptView(interaction.user.id)
+                prompt_msg = await interaction.followup.send(
+                    f"This looks like a receipt you already uploaded "
+                    f"(**{saved.get('merchant') or 'Unknown Merchant'}**, {saved.get('date') or 'unknown date'}). "
+                    f"Use the saved result?",
+                    view=view
+                )
+                await view.wait()
+                await prompt_msg.edit(view=None)
+
+                # No answer means the new photo is analyzed; a wrong match must never drop a receipt
+                if view.use_saved:
+                    summary, files_to_send = build_result(saved, title_prefix="Saved Receipt")
+                    await interaction.followup.send(content=summary, files=files_to_send)
+                    return
+                status_msg = prompt_msg
+
+        async def edit_status(**kwargs):
+            if status_msg:
+                await status_msg.edit(**kwargs)
+            else:
+                await interaction.edit_original_response(**kwargs)
+
+        # 3. Process with Gemini (or local OCR first, escalating to Gemini when unsure).
+        # The reply is streamed; the status message is edited as merchant and items arrive.
+        started = time.perf_counter()
+        # first_output_at is when the user first saw a partial result, kept per model:
+        # output from a tier that is later rejected (and escalated) doesn't count
+        progress = {'data': None, 'first_output_at': {}}
+
+        def on_progress(partial):
+            # Runs on the worker thread; the edit loop below picks up the latest state
+            progress['data'] = partial
+
+        async def show_progress():
+            shown = None
+            while True:
+                await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+                partial = progress['data']
+                if partial is not None and partial is not shown:
+                    shown = partial
+                    try:
+                        await edit_status(content=render_progress(partial))
+                    except discord.HTTPException as e:
+                        print(f"Progress edit failed: {e}")
+                        continue
+                    model = partial.get('routing', {}).get('model')
+                    if model not in progress['first_output_at'] and (partial.get('merchant') or partial.get('items')):
+                        progress['first_output_at'][model] = time.perf_counter()
+
+        progress_task = asyncio.create_task(show_progress())
+        try:
+            if LOCAL_FIRST_MODE:
+                data = await asyncio.to_thread(process_image_local_first, image_bytes, on_progress=on_progress)
+            else:
+                data = await asyncio.to_thread(process_image, image_bytes, on_progress=on_progress)
+        finally:
+            progress_task.cancel()
+            await asyncio.gather(progress_task, return_exceptions=True)
+
+        data = data or {}  # process_image returns [] on API errors
         items = data.get('items', [])
-        
+
+        # Time-to-first-useful-output vs. total time. Tiers that don't stream
+        # (local OCR, text-only LLM) first show something when they finish.
+        finished_at = time.perf_counter()
+        accepted_model = data.get('routing', {}).get('model')
+        first_output_at = progress['first_output_at'].get(accepted_model, finished_at)
+        engine = data.get('ocr', {}).get('engine') or data.get('routing', {}).get('model', MODEL_NAME)
+        # Metrics are best-effort; a failed insert must not lose the receipt
+        try:
+            database.record_ocr_metric('first_output', engine, (first_output_at - started) * 1000, bool(items))
+            database.record_ocr_metric('complete', engine, (finished_at - started) * 1000, bool(items))
+        except Exception as e:
+            print(f"Could not record OCR metric: {e}")
+
         if not items:
-            await interaction.followup.send("Could not identify items. Please checking key/image.")
+            await edit_status(content="Could not identify items. Please checking key/image.")
             return
         
-        # 3. Save to Database
+        # 4. Save to Database
         receipt_id = database.save_receipt(data)
+        if photo_hash is not None:
+            await asyncio.to_thread(image_hash.register, receipt_id, photo_hash)
         
-        # 4. Summarize
-        items = data.get('items', [])
-        total = sum(item['price'] for item in items)
-        item_count = len(items)
-        merchant = data.get('merchant', 'Unknown Merchant')
-        currency = data.get('currency', 'USD')
-        
-        # Currency symbol mapping for summary
-        currency_symbols = {'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥', 'CNY': '¥', 'KRW': '₩'}
-        symbol = currency_symbols.get(currency.upper(), currency + " ")
-        
-        # Get date from receipt, fallback to today's date if missing
-        date_str = data.get('date')
-        if not date_str or date_str == 'Unknown Date': # Handle both None and prompt default if any
-            date_str = datetime.datetime.now().strftime('%Y-%m-%d')
-
-        chart_title = f"{merchant} Expense Breakdown - {date_str}"
-
-        summary = (
-            f"**Processed Receipt**\n"
-            f"Found {item_count} items. Total: **{symbol}{total:.2f}**\n"
-#            f"_Saved to database (ID: {receipt_id})_"
-        )
-        
-        # 5. Chart
-        chart_buf = generate_pie_chart(items, title=chart_title, currency=currency)
-        
-        files_to_send = []
-        if chart_buf:
-            files_to_send.append(discord.File(chart_buf, filename="expense_chart.png"))
-            
-        await interaction.followup.send(content=summary, files=files_to_send)
+        # 5. Summarize and attach the chart to the progress message
+        summary, files_to_send = build_result(data)
+        await edit_status(content=summary, attachments=files_to_send)
         
     except Exception as e:
         await interaction.followup.send(f"Error processing receipt: {str(e)}")
         print(f"Error: {e}")
 
+@client.tree.command(name="history", description="Show spending charts across all saved receipts")
+@app_commands.describe(chart="Which chart to show", currency="Currency code, e.g. USD or JPY")
+@app_commands.choices(chart=[
+    app_commands.Choice(name="Spending over time", value="spending"),
+    app_commands.Choice(name="Top merchants", value="merchants"),
+    app_commands.Choice(name="Top items", value="items"),
+])
+async def history(interaction: discord.Interaction, chart: app_commands.Choice[str], currency: str = "USD"):
+    await interaction.response.defer(thinking=True)
+
+    try:
+        chart_buf = get_history_chart(chart.value, currency)
+        if chart_buf is None:
+            await interaction.followup.send(f"No saved receipts in {currency.upper()} yet.")
+            return
+
+        await interaction.followup.send(file=discord.File(chart_buf, filename=f"{chart.value}_chart.png"))
+
+    except Exception as e:
+        await interaction.followup.send(f"Error generating chart: {str(e)}")
+        print(f"Error: {e}")
+
 if __name__ == "__main__":
     if not TOKEN:
         print("Error: DISCORD_TOKEN not found in .env file.")
@@ -1,5 +1,23 @@
 import matplotlib.pyplot as plt
 import io
+from datetime import datetime, date
+import database
+
+# Simple symbol mapping
+CURRENCY_SYMBOLS = {
+    'USD': '$',
+    'CAD': '$',
+    'AUD': '$',
+    'EUR': '€',
+    'GBP': '£',
+    'JPY': '¥',
+    'CNY': '¥',
+    'KRW': '₩',
+}
+
+# Spend-over-time charts never plot more than this many points,
+# so rendering time stays flat no matter how many years of receipts exist
+MAX_TIME_SERIES_POINTS = 200
 
 def generate_pie_chart(items, title="Top Expense Items", top_n=10, currency="USD"):
     """
@@ -37,18 +55,7 @@ def generate_pie_chart(items, title="Top Expense Items", top_n=10, currency="USD
     sizes = [item['price'] for item in top_items]
     labels = []
     
-    # Simple symbol mapping
-    currency_symbols = {
-        'USD': '$',
-        'CAD': '$',
-        'AUD': '$',
-        'EUR': '€',
-        'GBP': '£',
-        'JPY': '¥',
-        'CNY': '¥',
-        'KRW': '₩',
-    }
-    symbol = currency_symbols.get(currency.upper(), currency + " ")
+    symbol = CURRENCY_SYMBOLS.get(currency.upper(), currency + " ")
 
     for item in top_items:
         qty_prefix = f"{item['count']} " if item.get('count', 1) > 1 else ""
@@ -62,11 +69,8 @@ def generate_pie_chart(items, title="Top Expense Items", top_n=10, currency="USD
     plt.figure(figsize=(10, 6))
     
     # Set CJK-compatible font
-    font_name = get_cjk_font()
-    if font_name:
-        plt.rcParams['font.sans-serif'] = [font_name] + plt.rcParams['font.sans-serif']
-        plt.rcParams['axes.unicode_minus'] = False # Fix minus sign
-        
+    _use_cjk_font()
+
     patches, texts, autotexts = plt.pie(
         sizes, 
         labels=labels, 
@@ -77,11 +81,146 @@ def generate_pie_chart(items, title="Top Expense Items", top_n=10, currency="USD
     plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
     plt.title(title, pad=20)
 
+    return _save_figure()
+
+def lttb(points, threshold):
+    """
+    Downsamples a time series with Largest-Triangle-Three-Buckets.
+    Keeps the first and last points and, from each bucket in between, the point
+    forming the largest triangle with its neighbours, so spikes survive.
+
+    Args:
+        points (list[tuple]): [(x, y), ...] sorted by x.
+        threshold (int): Number of points to keep.
+    """
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    a = 0  # Index of the last selected point
+
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # Average of the next bucket is the third corner of the triangle
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        best_area = -1
+        best_index = start
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best_index = j
+
+        sampled.append(points[best_index])
+        a = best_index
+
+    sampled.append(points[-1])
+    return sampled
+
+def _save_figure():
     buf = io.BytesIO()
     plt.savefig(buf, format='png', bbox_inches="tight")
     buf.seek(0)
     plt.close()
-    
+    return buf
+
+def _use_cjk_font():
+    font_name = get_cjk_font()
+    if font_name:
+        plt.rcParams['font.sans-serif'] = [font_name] + plt.rcParams['font.sans-serif']
+        plt.rcParams['axes.unicode_minus'] = False # Fix minus sign
+
+def generate_spending_chart(currency="USD", max_points=MAX_TIME_SERIES_POINTS):
+    """
+    Line chart of daily spend across all receipts in one currency.
+    Returns a bytes buffer containing the image, or None if there is no data.
+    """
+    rows = database.get_spend_over_time(currency)
+    if not rows:
+        return None
+
+    points = [(datetime.strptime(day, '%Y-%m-%d').toordinal(), amount) for day, amount in rows]
+    points = lttb(points, max_points)
+
+    dates = [date.fromordinal(x) for x, _ in points]
+    amounts = [y for _, y in points]
+    symbol = CURRENCY_SYMBOLS.get(currency.upper(), currency + " ")
+
+    plt.figure(figsize=(10, 5))
+    plt.plot(dates, amounts, marker='o' if len(points) < 50 else None, linewidth=1.5)
+    plt.title(f"Spending Over Time ({currency})", pad=20)
+    plt.ylabel(f"Spend ({symbol.strip()})")
+    plt.grid(True, alpha=0.3)
+    plt.gcf().autofmt_xdate()
+
+    return _save_figure()
+
+def _generate_bar_chart(rows, title, currency, count_label):
+    """Horizontal bar chart of [(label, amount, count), ...], largest at the top."""
+    if not rows:
+        return None
+
+    symbol = CURRENCY_SYMBOLS.get(currency.upper(), currency + " ")
+    labels = [f"{(label or 'Unknown')[:25]} ({count}{count_label})" for label, _, count in rows]
+    amounts = [amount for _, amount, _ in rows]
+
+    plt.figure(figsize=(10, 6))
+    _use_cjk_font()
+    bars = plt.barh(labels[::-1], amounts[::-1])
+    for bar, amount in zip(bars, amounts[::-1]):
+        amount_str = f"{int(amount)}" if currency.upper() in ['JPY', 'KRW'] else f"{amount:.2f}"
+        plt.text(bar.get_width(), bar.get_y() + bar.get_height() / 2, f" {symbol}{amount_str}", va='center')
+    plt.title(title, pad=20)
+    plt.margins(x=0.15)
+
+    return _save_figure()
+
+def generate_top_merchants_chart(currency="USD", top_n=10):
+    """Bar chart of the merchants with the most total spend."""
+    rows = database.get_top_merchants(currency, top_n)
+    return _generate_bar_chart(rows, f"Top Merchants ({currency})", currency, " receipts")
+
+def generate_top_items_chart(currency="USD", top_n=10):
+    """Bar chart of the items with the most total spend across all receipts."""
+    rows = database.get_top_items(currency, top_n)
+    return _generate_bar_chart(rows, f"Top Items ({currency})", currency, "x")
+
+HISTORY_CHARTS = {
+    'spending': generate_spending_chart,
+    'merchants': generate_top_merchants_chart,
+    'items': generate_top_items_chart,
+}
+
+# (chart, currency) -> (data version, png bytes)
+_history_cache = {}
+
+def get_history_chart(chart, currency="USD"):
+    """
+    Returns a history chart as a bytes buffer, re-rendering only when
+    receipts were added or removed since it was last drawn.
+    """
+    currency = currency.upper()
+    key = (chart, currency)
+    version = database.get_data_version()
+
+    cached = _history_cache.get(key)
+    if cached and cached[0] == version:
+        return io.BytesIO(cached[1])
+
+    buf = HISTORY_CHARTS[chart](currency)
+    if buf is None:
+        return None
+    _history_cache[key] = (version, buf.getvalue())
     return buf
 
 def get_cjk_font():
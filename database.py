@@ -46,7 +46,43 @@ def init_db():
             FOREIGN KEY (receipt_id) REFERENCES receipts (id)
         )
     ''')
-    
+
+    # Indexes for the spending-history aggregates
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_receipts_currency_date ON receipts (currency, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_items_receipt_id ON items (receipt_id)")
+
+    # Perceptual hashes of uploaded photos (near-duplicate detection)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            receipt_id INTEGER,
+            hash TEXT,
+            FOREIGN KEY (receipt_id) REFERENCES receipts (id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_hashes_receipt_id ON image_hashes (receipt_id)")
+
+    # OCR pipeline metrics (which engine/tier handled a receipt and how long it took)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ocr_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stage TEXT,
+            engine TEXT,
+            latency_ms REAL,
+            success INTEGER,
+            confidence REAL,
+            cost REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Check if cost column exists (migration for model routing)
+    cursor.execute("PRAGMA table_info(ocr_metrics)")
+    metric_columns = [info[1] for info in cursor.fetchall()]
+    if 'cost' not in metric_columns:
+        print("Migrating database: Adding cost column to ocr_metrics table...")
+        cursor.execute("ALTER TABLE ocr_metrics ADD COLUMN cost REAL")
+
     conn.commit()
     conn.close()
     #print(f"Database initialized: {DB_NAME}")
@@ -75,7 +111,7 @@ def save_receipt(data):
         merchant = data.get('merchant', 'Unknown')
         address = data.get('address')
         date = data.get('date')
-        currency = data.get('currency', 'USD')
+        currency = data.get('currency') or 'USD'
         items = data.get('items', [])
         
         # Calculate total just for the record (though we can sum items later)
@@ -106,3 +142,156 @@ def save_receipt(data):
         raise e
     finally:
         conn.close()
+
+def get_receipt(receipt_id):
+    """
+    Loads a saved receipt in the same format accepted by save_receipt.
+    Returns None if the receipt does not exist.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('''
+            SELECT merchant, address, date, currency
+            FROM receipts WHERE id = ?
+        ''', (receipt_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        cursor.execute("SELECT name, price FROM items WHERE receipt_id = ? ORDER BY id", (receipt_id,))
+        items = [{'name': name, 'price': price} for name, price in cursor.fetchall()]
+
+        return {
+            'id': receipt_id,
+            'merchant': row[0],
+            'address': row[1],
+            'date': row[2],
+            'currency': row[3] or 'USD',
+            'items': items
+        }
+    finally:
+        conn.close()
+
+def save_image_hash(receipt_id, image_hash):
+    """Stores the perceptual hash (hex string) of the photo a receipt was parsed from."""
+    conn = get_connection()
+    try:
+        conn.execute("INSERT INTO image_hashes (receipt_id, hash) VALUES (?, ?)", (receipt_id, image_hash))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_image_hashes():
+    """Returns [(receipt_id, hash), ...] for every stored photo hash."""
+    conn = get_connection()
+    try:
+        return conn.execute("SELECT receipt_id, hash FROM image_hashes").fetchall()
+    finally:
+        conn.close()
+
+def record_ocr_metric(stage, engine, latency_ms, success, confidence=None, cost=None):
+    """
+    Records one step of the OCR pipeline.
+
+    Args:
+        stage (str): Pipeline tier, e.g. 'local', 'text_llm', 'image_llm', or an
+            end-to-end timing: 'first_output' (first partial result shown) and 'complete'.
+        engine (str): OCR engine or model that ran, e.g. 'paddle', 'gemini-flash-latest'.
+        latency_ms (float): Wall-clock time of the step.
+        success (bool): Whether the step's result was accepted.
+        confidence (float): Parser confidence, when the step has one.
+        cost (float): Estimated USD cost of the step's API call, when known.
+    """
+    conn = get_connection()
+    try:
+        conn.execute('''
+            INSERT INTO ocr_metrics (stage, engine, latency_ms, success, confidence, cost)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (stage, engine, latency_ms, int(bool(success)), confidence, cost))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_ocr_stats():
+    """
+    Returns per-stage/engine counts, acceptance rate, average latency and cost from ocr_metrics.
+    For the 'route' stage a failed attempt is an escalation to the next model.
+    """
+    conn = get_connection()
+    try:
+        rows = conn.execute('''
+            SELECT stage, engine, COUNT(*), AVG(success), AVG(latency_ms), AVG(cost), SUM(cost)
+            FROM ocr_metrics
+            GROUP BY stage, engine
+            ORDER BY stage, engine
+        ''').fetchall()
+    finally:
+        conn.close()
+
+    return [
+        {
+            'stage': stage, 'engine': engine, 'runs': runs, 'success_rate': success_rate,
+            'avg_latency_ms': avg_latency, 'avg_cost': avg_cost, 'total_cost': total_cost
+        }
+        for stage, engine, runs, success_rate, avg_latency, avg_cost, total_cost in rows
+    ]
+
+def get_data_version():
+    """
+    Cheap fingerprint of the receipts table (row count and newest id).
+    Changes whenever receipts are added or removed; used to invalidate cached charts.
+    """
+    conn = get_connection()
+    try:
+        return conn.execute("SELECT COUNT(*), MAX(id) FROM receipts").fetchone()
+    finally:
+        conn.close()
+
+def get_spend_over_time(currency='USD'):
+    """Returns [(date, total spend), ...] per day, oldest first. Rows with invalid dates are skipped."""
+    conn = get_connection()
+    try:
+        return conn.execute('''
+            SELECT date, SUM(total_amount)
+            FROM receipts
+            -- Only real YYYY-MM-DD dates: SQLite's date() accepts 2024-02-30 as-is,
+            -- but normalizing it with a modifier changes it, so those rows drop out
+            WHERE currency = ? AND date(date, '+0 days') = date
+            GROUP BY date
+            ORDER BY date
+        ''', (currency,)).fetchall()
+    finally:
+        conn.close()
+
+def get_top_merchants(currency='USD', limit=10):
+    """Returns [(merchant, total spend, receipt count), ...], biggest spend first."""
+    conn = get_connection()
+    try:
+        return conn.execute('''
+            SELECT MAX(merchant), SUM(total_amount), COUNT(*)
+            FROM receipts
+            WHERE currency = ?
+            GROUP BY UPPER(TRIM(COALESCE(merchant, 'Unknown')))
+            ORDER BY SUM(total_amount) DESC
+            LIMIT ?
+        ''', (currency, limit)).fetchall()
+    finally:
+        conn.close()
+
+def get_top_items(currency='USD', limit=10):
+    """Returns [(item name, total spend, times bought), ...] across all receipts, biggest spend first."""
+    conn = get_connection()
+    try:
+        return conn.execute('''
+            SELECT MAX(i.name), SUM(i.price), COUNT(*)
+            FROM items i
+            JOIN receipts r ON r.id = i.receipt_id
+            WHERE r.currency = ?
+            GROUP BY UPPER(TRIM(i.name))
+            ORDER BY SUM(i.price) DESC
+            LIMIT ?
+        ''', (currency, limit)).fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,207 @@
+import io
+import os
+import math
+import threading
+from PIL import Image, ImageFilter, ImageOps
+import database
+
+# Two photos whose 256-bit pHashes differ in at most this many bits are treated as
+# the same receipt. Kept strict: a false match would offer the wrong saved receipt.
+# Re-uploads, resized or re-compressed copies and re-shots of the same receipt a few
+# degrees off or framed differently land at 0-6; different receipts at 30+.
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "12"))
+
+HASH_SIZE = 16         # 16x16 = 256-bit hash
+DCT_SIZE = 64          # Image is shrunk to 64x64 before the DCT
+PAPER_THRESHOLD = 170  # Pixels brighter than this (after autocontrast) count as receipt paper
+WORK_SIZE = 1024       # Photos are shrunk to this before any processing
+SKEW_SIZE = 512        # Resolution the paper's edges are measured at
+MAX_SKEW = 10          # Degrees; larger estimates are assumed to be wrong and ignored
+
+_cos_table = [
+    [math.cos(math.pi * (n + 0.5) * k / DCT_SIZE) for n in range(DCT_SIZE)]
+    for k in range(HASH_SIZE)
+]
+
+def _dct_low(values):
+    """First HASH_SIZE coefficients of a 1-D DCT-II over DCT_SIZE values."""
+    return [sum(v * c for v, c in zip(values, row)) for row in _cos_table]
+
+def _slope(points):
+    """Least-squares slope dx/dy of a line through [(y, x), ...]."""
+    mean_y = sum(y for y, _ in points) / len(points)
+    mean_x = sum(x for _, x in points) / len(points)
+    spread = sum((y - mean_y) ** 2 for y, _ in points)
+    if not spread:
+        return 0.0
+    return sum((y - mean_y) * (x - mean_x) for y, x in points) / spread
+
+def paper_skew(gray):
+    """
+    Estimates how far the receipt paper is tilted, from straight lines fitted to
+    its left and right edges. Returns the angle in degrees to pass to Image.rotate
+    to straighten it, or 0.0 when the paper's edges can't be told apart from the
+    background (e.g. a white receipt on a white table).
+    """
+    small = gray.copy()
+    small.thumbnail((SKEW_SIZE, SKEW_SIZE))
+    mask = small.point(lambda p: 255 if p > PAPER_THRESHOLD else 0)
+    # Fill in the printed text so every row of paper is one solid run
+    mask = mask.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.MinFilter(5))
+
+    width, height = mask.size
+    pixels = mask.tobytes()
+    edges = []  # (y, left x, right x) for rows where both paper edges are in frame
+    for y in range(height):
+        row = pixels[y * width:(y + 1) * width]
+        left, right = row.find(255), row.rfind(255)
+        if 0 < left and right < width - 1:
+            edges.append((y, left, right))
+
+    # The top and bottom of the paper are where the corners (and curls) are
+    edges = edges[len(edges) // 5:len(edges) - len(edges) // 5]
+    if len(edges) < height // 5:
+        return 0.0
+
+    slope = (_slope([(y, left) for y, left, _ in edges]) + _slope([(y, right) for y, _, right in edges])) / 2
+    angle = -math.degrees(math.atan(slope))
+    return angle if abs(angle) <= MAX_SKEW else 0.0
+
+def crop_receipt(image):
+    """
+    Straightens a tilted receipt and crops the photo to the bright receipt paper,
+    so the hash describes the printed content rather than the table, the framing
+    or the angle the photo was taken at.
+    Returns a grayscale image.
+    """
+    gray = ImageOps.autocontrast(image.convert('L'))
+    angle = paper_skew(gray)
+    if angle:
+        # Fill the new corners with black so they don't count as paper
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=0)
+    paper = gray.point(lambda p: 255 if p > PAPER_THRESHOLD else 0).getbbox()
+    if paper:
+        gray = gray.crop(paper)
+    return gray
+
+def phash(image_bytes):
+    """
+    Computes a 256-bit perceptual hash (pHash) of the receipt in a photo.
+    The receipt is straightened and cropped out, shrunk to 64x64 grayscale, and
+    each bit records whether one of the 16x16 lowest-frequency DCT coefficients is
+    above the median, so the hash survives resizing, re-compression, lighting
+    changes and re-shooting the receipt at a slightly different angle.
+    Returns the hash as an int.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft('L', (WORK_SIZE, WORK_SIZE))  # Let the JPEG decoder skip most of a 12 MP photo
+    image = ImageOps.exif_transpose(image)  # Phone photos are often stored rotated
+    image.thumbnail((WORK_SIZE, WORK_SIZE))
+    image = crop_receipt(image).resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS)
+    pixels = list(image.tobytes())  # One byte per pixel in 'L' mode
+
+    rows = [_dct_low(pixels[r * DCT_SIZE:(r + 1) * DCT_SIZE]) for r in range(DCT_SIZE)]
+    columns = [_dct_low([row[c] for row in rows]) for c in range(HASH_SIZE)]
+    coefficients = [columns[c][r] for r in range(HASH_SIZE) for c in range(HASH_SIZE)]
+
+    # The DC term (overall brightness) would skew the median
+    median = sorted(coefficients[1:])[len(coefficients) // 2]
+
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (1 if coefficient > median else 0)
+    return value
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+HASH_HEX_LENGTH = HASH_SIZE * HASH_SIZE // 4
+
+def hash_to_hex(value):
+    return f"{value:0{HASH_HEX_LENGTH}x}"
+
+def hex_to_hash(text):
+    return int(text, 16)
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance.
+    A lookup only descends into children whose edge distance is within
+    max_distance of the query's distance to the node, so near-duplicate
+    search touches a small fraction of the stored hashes.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, [values], {distance: child}]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Returns [(distance, item), ...] for every stored hash within max_distance, closest first."""
+        matches = []
+        if self.root is None:
+            return matches
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+_tree = None
+_tree_lock = threading.Lock()  # Lookups and inserts run on worker threads
+
+def _get_tree():
+    """Builds the BK-tree from the image_hashes table on first use."""
+    global _tree
+    if _tree is None:
+        _tree = BKTree()
+        for receipt_id, hex_hash in database.get_image_hashes():
+            _tree.add(hex_to_hash(hex_hash), receipt_id)
+    return _tree
+
+def find_duplicate(image_hash, max_distance=None):
+    """
+    Looks for a previously saved receipt whose photo is a near-duplicate.
+    Returns (receipt_id, distance) for the closest match, or None.
+    """
+    if max_distance is None:
+        max_distance = DUPLICATE_MAX_DISTANCE
+
+    with _tree_lock:
+        matches = _get_tree().search(image_hash, max_distance)
+    if not matches:
+        return None
+    distance, receipt_id = matches[0]
+    return receipt_id, distance
+
+def register(receipt_id, image_hash):
+    """Stores the hash for a newly saved receipt and adds it to the in-memory index."""
+    with _tree_lock:
+        tree = _get_tree()  # Load before saving so the new row isn't indexed twice
+        database.save_image_hash(receipt_id, hash_to_hex(image_hash))
+        tree.add(image_hash, receipt_id)
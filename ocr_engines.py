@@ -0,0 +1,130 @@
+import io
+import os
+import multiprocessing
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+
+# Local (on-box) OCR engines. Each engine turns an image into plain text with
+# one receipt line per text line. Engines run in a process pool so a slow OCR
+# pass doesn't hold the bot process's GIL; run_engine itself still blocks until
+# the text is ready, so async callers should run it off the event loop.
+#
+# Pick an engine with LOCAL_OCR_ENGINE=paddle|tesseract in .env.
+
+LOCAL_OCR_ENGINE = os.getenv("LOCAL_OCR_ENGINE", "paddle")
+LOCAL_OCR_WORKERS = int(os.getenv("LOCAL_OCR_WORKERS", "2"))
+LOCAL_OCR_TIMEOUT = 60  # seconds
+
+class OCREngine(ABC):
+    """Base class for local OCR engines."""
+    name = "base"
+
+    @abstractmethod
+    def extract_text(self, image_bytes):
+        """Returns the text found in the image, one line per receipt row."""
+
+# Loaded models, cached per worker process (models are too heavy to pickle
+# or to reload for every receipt)
+_models = {}
+
+class PaddleOCREngine(OCREngine):
+    name = "paddle"
+
+    def __init__(self, lang='en'):
+        self.lang = lang
+
+    def _get_model(self):
+        key = (self.name, self.lang)
+        if key not in _models:
+            from paddleocr import PaddleOCR
+            _models[key] = PaddleOCR(use_angle_cls=True, lang=self.lang)
+        return _models[key]
+
+    def extract_text(self, image_bytes):
+        import numpy as np
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        array = np.array(image)[:, :, ::-1]  # PaddleOCR expects BGR like OpenCV
+        result = self._get_model().ocr(array, cls=True)
+
+        boxes = []
+        page = result[0] if result else None
+        for line in page or []:
+            points, (text, _score) = line
+            ys = [point[1] for point in points]
+            boxes.append({
+                'y': sum(ys) / len(ys),
+                'x': min(point[0] for point in points),
+                'height': max(ys) - min(ys),
+                'text': text,
+            })
+        return group_boxes_into_lines(boxes)
+
+class TesseractEngine(OCREngine):
+    name = "tesseract"
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+
+    def extract_text(self, image_bytes):
+        import pytesseract
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(image_bytes))
+        # psm 4: a single column of text of variable sizes (receipt layout)
+        return pytesseract.image_to_string(image, lang=self.lang, config='--psm 4')
+
+ENGINES = {
+    PaddleOCREngine.name: PaddleOCREngine,
+    TesseractEngine.name: TesseractEngine,
+}
+
+def get_engine(name=None):
+    """Creates the configured local OCR engine."""
+    name = name or LOCAL_OCR_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"Unknown OCR engine '{name}'. Choose from: {', '.join(ENGINES)}")
+    return ENGINES[name]()
+
+def group_boxes_into_lines(boxes):
+    """
+    Joins word/segment boxes into text lines.
+    Detectors like PaddleOCR return the item name and its price as separate boxes;
+    boxes whose vertical centres are within half a box height belong to the same row.
+    """
+    rows = []
+    for box in sorted(boxes, key=lambda b: b['y']):
+        if rows and abs(box['y'] - rows[-1]['y']) <= max(box['height'], rows[-1]['height']) / 2:
+            rows[-1]['boxes'].append(box)
+        else:
+            rows.append({'y': box['y'], 'height': box['height'], 'boxes': [box]})
+
+    lines = []
+    for row in rows:
+        lines.append(" ".join(box['text'] for box in sorted(row['boxes'], key=lambda b: b['x'])))
+    return "\n".join(lines)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # The pool is first used from a worker thread of the (multi-threaded) bot
+            # process, where forking can deadlock the child; spawn fresh workers
+            # instead. Models are loaded inside each worker anyway (see _models).
+            _pool = ProcessPoolExecutor(max_workers=LOCAL_OCR_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def _run_engine(engine, image_bytes):
+    return engine.extract_text(image_bytes)
+
+def run_engine(engine, image_bytes, use_pool=True):
+    """Runs an engine on an image, in the shared process pool unless use_pool is False."""
+    if not use_pool:
+        return _run_engine(engine, image_bytes)
+    return _get_pool().submit(_run_engine, engine, image_bytes).result(timeout=LOCAL_OCR_TIMEOUT)
@@ -0,0 +1,232 @@
+import re
+from datetime import datetime
+
+# Deterministic parser for plain OCR text (one receipt line per text line).
+# It is cheap enough to run on every upload; its confidence score decides
+# whether the result can be used as-is or needs an LLM.
+
+# Amounts may use thousands separators in either locale: 1,299.99 or 1.299,99
+PRICE_RE = re.compile(
+    r'(-)?\s*[$€£¥₩]?\s*(\d{1,3}(?:[,.]\d{3})+[.,]\d{2}|\d{1,6}[.,]\d{2})\s*(-)?(?:\s+[A-Z*]{1,2})?\s*$'
+)
+
+def _keywords(*words):
+    # Whole words only, so "cash" doesn't match "CASHEWS"
+    return re.compile(r'\b(' + '|'.join(re.escape(word) for word in words) + r')\b', re.IGNORECASE)
+
+SUBTOTAL_RE = _keywords('subtotal', 'sub total', 'sub-total')
+TAX_RE = _keywords('tax', 'hst', 'gst', 'vat')
+TOTAL_RE = _keywords('total', 'amount due', 'balance due')
+SKIP_RE = _keywords(
+    'change', 'cash', 'visa', 'mastercard', 'amex', 'balance', 'tender',
+    'payment', 'debit', 'credit', 'tip', 'rounding',
+)
+DISCOUNT_RE = _keywords('savings', 'instant savings', 'coupon', 'discount')
+
+CURRENCY_MARKERS = [
+    ('€', 'EUR'), ('£', 'GBP'), ('₩', 'KRW'), ('円', 'JPY'), ('¥', 'JPY'),
+    ('EUR', 'EUR'), ('GBP', 'GBP'), ('JPY', 'JPY'), ('CNY', 'CNY'), ('RMB', 'CNY'),
+    ('KRW', 'KRW'), ('CAD', 'CAD'), ('AUD', 'AUD'), ('USD', 'USD'),
+]
+
+DATE_PATTERNS = [
+    (re.compile(r'\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b'), ('y', 'm', 'd')),
+    (re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b'), ('m', 'd', 'y')),
+    (re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{2})\b'), ('m', 'd', 'y')),
+    (re.compile(r'\b(\d{1,2})\.(\d{1,2})\.(\d{4})\b'), ('d', 'm', 'y')),
+]
+
+ADDRESS_RE = re.compile(r'^\d+\s+\w+.*\b(st|street|ave|avenue|rd|road|blvd|dr|drive|ln|lane|way|hwy|pkwy|ct|pl)\b', re.IGNORECASE)
+
+# Parser results at or above this confidence are used without calling an LLM
+CONFIDENCE_THRESHOLD = 0.85
+
+# Currencies a receipt result may report; anything else is treated as a misread
+KNOWN_CURRENCIES = {
+    'USD', 'CAD', 'AUD', 'NZD', 'EUR', 'GBP', 'CHF', 'SEK', 'NOK', 'DKK', 'PLN',
+    'JPY', 'CNY', 'KRW', 'HKD', 'TWD', 'SGD', 'THB', 'INR', 'MXN', 'BRL',
+}
+MAX_ITEMS = 300  # More than this is almost certainly a hallucinated list
+
+def _parse_price(text):
+    # The last separator is always the decimal point; any earlier ones group thousands
+    whole, cents = text[:-3], text[-2:]
+    return float(re.sub(r'[.,]', '', whole) + '.' + cents)
+
+def _find_date(line):
+    for pattern, order in DATE_PATTERNS:
+        match = pattern.search(line)
+        if not match:
+            continue
+        parts = dict(zip(order, (int(group) for group in match.groups())))
+        if parts['y'] < 100:
+            parts['y'] += 2000
+        try:
+            return datetime(parts['y'], parts['m'], parts['d']).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+def _find_currency(text):
+    for marker, code in CURRENCY_MARKERS:
+        if marker in text:
+            return code
+    return 'USD'
+
+def _totals_match(items_sum, subtotal=None, tax=None, total=None):
+    """
+    Whether the items add up to the printed subtotal, or to the total once tax is added.
+    Prices may already include tax (common in the EU and Japan, where the receipt
+    prints "VAT included"), so the items may also add up to the total on their own.
+    Returns False when neither subtotal nor total was printed.
+    """
+    def close(expected, actual):
+        return abs(expected - actual) <= max(0.05, abs(expected) * 0.005)
+
+    if subtotal is not None and close(subtotal, items_sum):
+        return True
+    if total is not None and (close(total, items_sum + (tax or 0)) or close(total, items_sum)):
+        return True
+    return False
+
+def _valid_date(value):
+    try:
+        parsed = datetime.strptime(str(value), '%Y-%m-%d')
+    except ValueError:
+        return False
+    return datetime(2000, 1, 1) <= parsed <= datetime.now()
+
+def validate_receipt(data):
+    """
+    Cheap local self-consistency checks for a parsed receipt (from any model or parser).
+
+    Returns:
+        list[str]: Names of the failed checks; empty if the receipt looks right.
+            'item_count', 'item_prices', 'total_mismatch', 'date' (unparseable or in
+            the future; a missing date passes), 'currency'
+    """
+    if not isinstance(data, dict):
+        return ['not_an_object']
+
+    failures = []
+    items = data.get('items') or []
+    if not 0 < len(items) <= MAX_ITEMS:
+        failures.append('item_count')
+
+    try:
+        items_sum = sum(float(item['price']) for item in items)
+    except (KeyError, TypeError, ValueError):
+        failures.append('item_prices')
+        items_sum = None
+
+    # Only checked when the receipt has a printed subtotal/total to compare against
+    try:
+        printed = [
+            None if data.get(key) is None else float(data[key])
+            for key in ('printed_subtotal', 'printed_tax', 'printed_total')
+        ]
+    except (TypeError, ValueError):
+        printed = [None, None, None]
+    subtotal, tax, total = printed
+    if items_sum is not None and (subtotal is not None or total is not None):
+        if not _totals_match(items_sum, subtotal, tax, total):
+            failures.append('total_mismatch')
+
+    # Many receipts print no date at all (the bot falls back to today's date), and a
+    # stronger model can't find one either; only a present but bad date escalates
+    date = data.get('date')
+    if date not in (None, '', 'Unknown Date') and not _valid_date(date):
+        failures.append('date')
+    if str(data.get('currency') or '').upper() not in KNOWN_CURRENCIES:
+        failures.append('currency')
+
+    return failures
+
+def parse_receipt_text(text):
+    """
+    Parses OCR'd receipt text into the same structure process_image returns.
+
+    Returns:
+        tuple: (data, confidence) where confidence is between 0.0 and 1.0.
+            data also carries 'printed_subtotal' / 'printed_tax' / 'printed_total' when those lines were found.
+    """
+    merchant = None
+    address = None
+    date = None
+    subtotal = None
+    tax = None
+    printed_total = None
+    items = []
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        if date is None:
+            date = _find_date(line)
+
+        match = PRICE_RE.search(line)
+        if not match:
+            # Header lines come before the first item
+            if not items:
+                if merchant is None and re.search(r'[A-Za-z]{2,}', line) and not _find_date(line):
+                    merchant = line
+                elif address is None and ADDRESS_RE.search(line):
+                    address = line
+            continue
+
+        price = _parse_price(match.group(2))
+        negative = bool(match.group(1) or match.group(3))
+        name = line[:match.start()].strip(' .:$')
+
+        if SUBTOTAL_RE.search(line):
+            subtotal = price
+            continue
+        if TAX_RE.search(line):
+            tax = (tax or 0) + price
+            continue
+        if TOTAL_RE.search(line):
+            printed_total = price
+            continue
+        if SKIP_RE.search(line):
+            continue
+
+        if negative or DISCOUNT_RE.search(line):
+            # Discount applies to the item above it
+            if items:
+                items[-1]['price'] = round(items[-1]['price'] - price, 2)
+            continue
+
+        # Strip leading item codes (e.g. "123456 MILK")
+        name = re.sub(r'^\d{4,}\s+', '', name)
+        if not re.search(r'[^\W\d_]', name):
+            continue
+        items.append({'name': name, 'price': price})
+
+    data = {
+        'merchant': merchant or 'Unknown',
+        'address': address,
+        'date': date,
+        'currency': _find_currency(text),
+        'items': items,
+    }
+    if printed_total is not None:
+        data['printed_total'] = printed_total
+    if subtotal is not None:
+        data['printed_subtotal'] = subtotal
+    if tax is not None:
+        data['printed_tax'] = round(tax, 2)
+
+    if not items:
+        return data, 0.0
+
+    confidence = 0.2
+    if _totals_match(sum(item['price'] for item in items), subtotal, tax, printed_total):
+        confidence += 0.5
+    if date:
+        confidence += 0.15
+    if merchant:
+        confidence += 0.15
+
+    return data, round(confidence, 2)
@@ -0,0 +1,31 @@
+import database
+from ocr_processor import MODEL_TIERS
+
+# Prints how each OCR tier/model performs on real traffic, to tune MODEL_TIERS.
+
+def print_stats():
+    database.init_db()
+    stats = database.get_ocr_stats()
+    if not stats:
+        print("No OCR metrics recorded yet.")
+        return
+
+    print(f"{'Stage':<14}{'Engine':<28}{'Runs':>6}{'Success':>9}{'Avg ms':>10}{'Avg $':>11}{'Total $':>10}")
+    for row in stats:
+        avg_cost = f"{row['avg_cost']:.6f}" if row['avg_cost'] is not None else "-"
+        total_cost = f"{row['total_cost']:.4f}" if row['total_cost'] is not None else "-"
+        print(
+            f"{row['stage']:<14}{str(row['engine']):<28}{row['runs']:>6}"
+            f"{row['success_rate']:>9.0%}{row['avg_latency_ms']:>10.0f}{avg_cost:>11}{total_cost:>10}"
+        )
+
+    # Every failed routing attempt (except on the last tier) is an escalation
+    print("\nEscalation rate per routing tier:")
+    routed = {row['engine']: row for row in stats if row['stage'] == 'route'}
+    for model_name in MODEL_TIERS[:-1]:
+        row = routed.get(model_name)
+        if row:
+            print(f"- {model_name}: {1 - row['success_rate']:.0%} of {row['runs']} receipts escalated")
+
+if __name__ == "__main__":
+    print_stats()
@@ -0,0 +1,71 @@
+import json
+
+class IncrementalJSONParser:
+    """
+    Parses a JSON object that arrives in chunks (e.g. a streamed Gemini reply).
+
+    Characters are scanned once, tracking string/escape state and the stack of
+    open brackets. Every ',' or closing bracket outside a string is a safe place
+    to cut: the text up to there plus the missing closing brackets is valid JSON.
+    feed() parses the latest cut, so callers see each field or list entry as soon
+    as it is complete.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.start = None      # Index of the opening '{' (skips ```json fences)
+        self.stack = []        # Closing brackets still owed
+        self.in_string = False
+        self.escape = False
+        self.cut = None        # (end index, closing brackets) of the latest safe cut
+        self.result = None
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of text.
+        Returns the partial object parsed so far if it grew with this chunk, else None.
+        """
+        self.buffer += chunk
+        advanced = False
+
+        while self.pos < len(self.buffer):
+            ch = self.buffer[self.pos]
+
+            if self.start is None:
+                if ch == '{':
+                    self.start = self.pos
+                    self.stack.append('}')
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == '{':
+                self.stack.append('}')
+            elif ch == '[':
+                self.stack.append(']')
+            elif ch in '}]':
+                if self.stack:
+                    self.stack.pop()
+                self.cut = (self.pos + 1, ''.join(reversed(self.stack)))
+                advanced = True
+            elif ch == ',':
+                self.cut = (self.pos, ''.join(reversed(self.stack)))
+                advanced = True
+
+            self.pos += 1
+
+        if not advanced or self.start is None:
+            return None
+
+        end, closers = self.cut
+        try:
+            self.result = json.loads(self.buffer[self.start:end] + closers)
+        except ValueError:
+            return None
+        return self.result
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import database
+import chart_generator
+from chart_generator import lttb, get_history_chart
+
+def test_lttb():
+    points = [(x, (x % 7) * 1.0) for x in range(1000)]
+    points[500] = (500, 1000.0)  # One big shopping trip
+
+    sampled = lttb(points, 50)
+    print(f"Downsampled {len(points)} -> {len(sampled)} points")
+    assert len(sampled) == 50
+    assert sampled[0] == points[0]
+    assert sampled[-1] == points[-1]
+    assert (500, 1000.0) in sampled  # Spikes survive downsampling
+    assert sampled == sorted(sampled)
+
+    # Short series are left alone
+    assert lttb(points[:10], 50) == points[:10]
+
+def test_history_charts():
+    # Use a throwaway database and start with an empty chart cache; restore both
+    # afterwards so later tests keep writing to the real receipts.db
+    original_db = database.DB_NAME
+    temp_dir = tempfile.mkdtemp()
+    database.DB_NAME = os.path.join(temp_dir, "test_history.db")
+    chart_generator._history_cache.clear()
+
+    try:
+        database.init_db()
+
+        database.save_receipt({'merchant': 'Costco', 'date': '2024-01-05', 'currency': 'USD',
+                               'items': [{'name': 'Milk', 'price': 3.99}, {'name': 'TV', 'price': 299.99}]})
+        database.save_receipt({'merchant': 'COSTCO', 'date': '2024-01-20', 'currency': 'USD',
+                               'items': [{'name': 'Milk', 'price': 3.99}]})
+        database.save_receipt({'merchant': 'Lawson', 'date': '2024-01-21', 'currency': 'JPY',
+                               'items': [{'name': 'Onigiri', 'price': 150}]})
+        # Misread dates must not break the spending chart
+        database.save_receipt({'merchant': 'Costco', 'date': '2024-02-30', 'currency': 'USD',
+                               'items': [{'name': 'Milk', 'price': 3.99}]})
+        database.save_receipt({'merchant': 'Costco', 'date': 'Unknown Date', 'currency': 'USD',
+                               'items': [{'name': 'Milk', 'price': 3.99}]})
+
+        merchants = database.get_top_merchants('USD')
+        print("Top merchants:", merchants)
+        assert len(merchants) == 1  # Merchant names are grouped case-insensitively
+        assert merchants[0][2] == 4
+
+        items = database.get_top_items('USD')
+        print("Top items:", items)
+        assert items[0][0] == 'TV'
+        assert items[1][2] == 4  # Milk bought four times
+
+        assert database.get_spend_over_time('USD') == [('2024-01-05', 303.98), ('2024-01-20', 3.99)]
+        assert get_history_chart('spending', 'USD') is not None
+
+        # Charts are cached until a new receipt arrives
+        first = get_history_chart('merchants', 'USD')
+        second = get_history_chart('merchants', 'USD')
+        assert first.getvalue() == second.getvalue()
+
+        database.save_receipt({'merchant': 'Target', 'date': '2024-02-01', 'currency': 'USD',
+                               'items': [{'name': 'Socks', 'price': 9.99}]})
+        third = get_history_chart('merchants', 'USD')
+        assert third.getvalue() != first.getvalue()
+
+        assert get_history_chart('spending', 'EUR') is None
+
+        print("SUCCESS: History chart verification passed!")
+    finally:
+        database.DB_NAME = original_db
+        chart_generator._history_cache.clear()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_lttb()
+    test_history_charts()
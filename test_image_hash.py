@@ -0,0 +1,82 @@
+import io
+import random
+from PIL import Image, ImageDraw
+from image_hash import phash, hamming_distance, BKTree, DUPLICATE_MAX_DISTANCE
+
+TABLE = (60, 50, 40)
+
+def draw_receipt(lines, dx=0, dy=0):
+    """A receipt photo: white paper on a dark table, shifted by (dx, dy) in the frame."""
+    image = Image.new('RGB', (1200, 1600), TABLE)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((300 + dx, 100 + dy, 900 + dx, 1500 + dy), fill=(245, 245, 240))
+    for i, line in enumerate(lines):
+        draw.text((330 + dx, 140 + dy + i * 40), line, fill=(20, 20, 20), font_size=28)
+    return image
+
+def to_jpeg(image, quality=90):
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+COSTCO = ["COSTCO WHOLESALE", "123 MAIN ST", "03/02/2024", "MILK 3.99", "EGGS 6.49",
+          "BREAD 2.00", "TV 299.99", "SUBTOTAL 312.47", "TAX 25.00", "TOTAL 337.47"]
+TRADER_JOES = ["TRADER JOES", "88 ELM AVE", "11/20/2023", "BANANAS 1.29", "YOGURT 4.99",
+               "COFFEE 8.99", "FLOWERS 5.99", "CHEESE 7.49", "SUBTOTAL 28.75", "TOTAL 28.75"]
+# Same store, same header and layout, different purchases
+COSTCO_OTHER_DAY = COSTCO[:3] + ["APPLES 4.99", "RICE 12.49", "SOAP 3.00", "CHIPS 4.99",
+                                 "SUBTOTAL 25.47", "TAX 2.00", "TOTAL 27.47"]
+
+def test_same_receipt_matched():
+    photo = draw_receipt(COSTCO)
+    original = to_jpeg(photo)
+
+    # Re-uploaded copy: smaller and re-compressed
+    width, height = photo.size
+    copy = to_jpeg(photo.resize((width // 2, height // 2)), quality=60)
+
+    distance = hamming_distance(phash(original), phash(copy))
+    print(f"Distance to re-uploaded copy: {distance}")
+    assert distance <= DUPLICATE_MAX_DISTANCE
+
+def test_reshot_receipt_matched():
+    original = phash(to_jpeg(draw_receipt(COSTCO)))
+    other_day = phash(to_jpeg(draw_receipt(COSTCO_OTHER_DAY)))
+
+    # The same receipt photographed again: a little tilted and framed differently
+    for angle, dx, dy in ((2, 40, -30), (-2, -60, 50), (1, 0, 0)):
+        photo = draw_receipt(COSTCO, dx, dy).rotate(angle, resample=Image.BICUBIC, fillcolor=TABLE)
+        reshot = phash(to_jpeg(photo))
+        print(f"Distance to re-shot photo at {angle} degrees: {hamming_distance(original, reshot)}")
+        assert hamming_distance(original, reshot) <= DUPLICATE_MAX_DISTANCE
+        assert hamming_distance(other_day, reshot) > DUPLICATE_MAX_DISTANCE
+
+def test_different_receipts_not_matched():
+    original = phash(to_jpeg(draw_receipt(COSTCO)))
+
+    for lines in (TRADER_JOES, COSTCO_OTHER_DAY):
+        distance = hamming_distance(original, phash(to_jpeg(draw_receipt(lines))))
+        print(f"Distance to a different receipt: {distance}")
+        assert distance > DUPLICATE_MAX_DISTANCE
+
+def test_bk_tree_matches_linear_scan():
+    rng = random.Random(42)
+    hashes = [rng.getrandbits(256) for _ in range(2000)]
+
+    tree = BKTree()
+    for receipt_id, value in enumerate(hashes):
+        tree.add(value, receipt_id)
+
+    for _ in range(50):
+        query = rng.choice(hashes) ^ (1 << rng.randrange(256))  # One bit flipped
+        expected = sorted(i for i, value in enumerate(hashes) if hamming_distance(query, value) <= 12)
+        found = sorted(receipt_id for _, receipt_id in tree.search(query, 12))
+        assert found == expected
+
+    print("SUCCESS: Image hash verification passed!")
+
+if __name__ == "__main__":
+    test_same_receipt_matched()
+    test_reshot_receipt_matched()
+    test_different_receipts_not_matched()
+    test_bk_tree_matches_linear_scan()
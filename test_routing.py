@@ -0,0 +1,119 @@
+import json
+import database
+from receipt_parser import validate_receipt
+import ocr_processor
+from ocr_processor import route_image
+
+GOOD = {
+    'merchant': 'Target',
+    'date': '2024-03-15',
+    'currency': 'USD',
+    'items': [{'name': 'Shampoo', 'price': 6.49}, {'name': 'Paper Towels', 'price': 12.99}],
+    'printed_subtotal': 19.48,
+    'printed_tax': 1.56,
+    'printed_total': 21.04
+}
+
+# Cheap model dropped an item, so the items no longer add up
+MISSING_ITEM = dict(GOOD, items=[{'name': 'Shampoo', 'price': 6.49}])
+
+def test_validate_receipt():
+    assert validate_receipt(GOOD) == []
+    assert validate_receipt(MISSING_ITEM) == ['total_mismatch']
+    assert validate_receipt(dict(GOOD, printed_subtotal=None)) == []  # Total - tax still matches
+    # Prices already include VAT; the printed tax is informational
+    vat_included = dict(GOOD, currency='EUR', items=[{'name': 'Kaffee', 'price': 10.0}, {'name': 'Brot', 'price': 13.5}],
+                        printed_subtotal=None, printed_tax=3.75, printed_total=23.5)
+    assert validate_receipt(vat_included) == []
+    assert 'date' in validate_receipt(dict(GOOD, date='15/03/2024'))
+    assert 'date' in validate_receipt(dict(GOOD, date='2099-01-01'))
+    assert validate_receipt(dict(GOOD, date=None)) == []  # No printed date is not a misread
+    assert 'currency' in validate_receipt(dict(GOOD, currency='XYZ'))
+    assert 'item_count' in validate_receipt(dict(GOOD, items=[]))
+    assert 'item_prices' in validate_receipt(dict(GOOD, items=[{'name': 'Shampoo', 'price': 'six'}]))
+
+class StubLLM:
+    """Returns a canned reply per model and records which models were called."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = []
+
+    def __call__(self, prompt, image_bytes=None, model_name=None):
+        self.calls.append(model_name)
+        return json.dumps(self.replies[model_name])
+
+def test_cheapest_model_accepted():
+    llm = StubLLM({'lite': GOOD, 'flash': GOOD, 'pro': GOOD})
+    data = route_image(b"fake", tiers=['lite', 'flash', 'pro'], llm=llm)
+    assert llm.calls == ['lite']
+    assert data['routing']['model'] == 'lite'
+
+def test_escalation():
+    llm = StubLLM({'lite': MISSING_ITEM, 'flash': GOOD, 'pro': GOOD})
+    data = route_image(b"fake", tiers=['lite', 'flash', 'pro'], llm=llm)
+    print("Routed:", data['routing'])
+    assert llm.calls == ['lite', 'flash']
+    assert data['routing']['model'] == 'flash'
+    assert data['routing']['failed_checks'] == {'lite': ['total_mismatch']}
+    assert len(data['items']) == 2
+
+def test_missing_date_not_escalated():
+    llm = StubLLM({'lite': dict(GOOD, date=None), 'flash': GOOD, 'pro': GOOD})
+    data = route_image(b"fake", tiers=['lite', 'flash', 'pro'], llm=llm)
+    assert llm.calls == ['lite']
+    assert data['date'] is None
+
+class StubChunk:
+    def __init__(self, text=None):
+        self.parts = [text] if text is not None else []
+
+    @property
+    def text(self):
+        if not self.parts:
+            raise ValueError("The `response.text` quick accessor requires the response to contain a valid `Part`")
+        return self.parts[0]
+
+def test_stream_chunk_without_text():
+    # The final streamed chunk may only carry a finish reason
+    assert ocr_processor._chunk_text(StubChunk('{"merchant"')) == '{"merchant"'
+    assert ocr_processor._chunk_text(StubChunk()) == ''
+
+def test_progress_tagged_with_tier():
+    replies = {'lite': MISSING_ITEM, 'flash': GOOD}
+
+    def fake_generate(model_name, prompt, image_bytes=None, on_progress=None):
+        # Stream one partial result per model, then the full reply
+        on_progress({'merchant': replies[model_name]['merchant'], 'items': []})
+        return json.dumps(replies[model_name]), None
+
+    partials = []
+    original_generate = ocr_processor._generate
+    ocr_processor._generate = fake_generate
+    try:
+        data = route_image(b"fake", on_progress=partials.append, tiers=['lite', 'flash'])
+    finally:
+        ocr_processor._generate = original_generate
+
+    # The caller can tell the escalated stream apart from the rejected one
+    assert [p['routing'] for p in partials] == [{'model': 'lite', 'tier': 0}, {'model': 'flash', 'tier': 1}]
+    assert data['routing']['model'] == 'flash'
+    assert data['routing']['tier'] == 1
+
+def test_all_tiers_fail():
+    # Keep the result with the fewest failed checks
+    llm = StubLLM({'lite': dict(MISSING_ITEM, currency='???'), 'flash': MISSING_ITEM})
+    data = route_image(b"fake", tiers=['lite', 'flash'], llm=llm)
+    assert data['routing']['model'] == 'flash'
+
+    print("SUCCESS: Model routing verification passed!")
+
+if __name__ == "__main__":
+    database.init_db()
+    test_validate_receipt()
+    test_cheapest_model_accepted()
+    test_escalation()
+    test_missing_date_not_escalated()
+    test_stream_chunk_without_text()
+    test_progress_tagged_with_tier()
+    test_all_tiers_fail()
@@ -0,0 +1,43 @@
+import json
+from stream_parser import IncrementalJSONParser
+
+RECEIPT = {
+    "merchant": "Joe's \"Best\" Deli, Inc.",
+    "address": "1 Main St, Springfield",
+    "date": "2024-05-01",
+    "currency": "USD",
+    "items": [
+        {"name": "Bagel [Everything]", "price": 2.5},
+        {"name": "Coffee, Large", "price": 3.25},
+        {"name": "Cream Cheese {Lite}", "price": 1.0}
+    ]
+}
+
+def test_incremental_parser():
+    # Gemini sometimes wraps the reply in a ```json fence
+    text = "```json\n" + json.dumps(RECEIPT, indent=2) + "\n```"
+
+    parser = IncrementalJSONParser()
+    snapshots = []
+    for i in range(0, len(text), 5):  # Small, uneven chunks
+        partial = parser.feed(text[i:i + 5])
+        if partial is not None:
+            snapshots.append(partial)
+
+    print(f"{len(snapshots)} partial results")
+    # The merchant is available long before the items are finished
+    first_with_merchant = next(i for i, s in enumerate(snapshots) if 'merchant' in s)
+    first_complete = next(i for i, s in enumerate(snapshots) if s == RECEIPT)
+    assert first_with_merchant < first_complete
+    assert snapshots[first_with_merchant]['merchant'] == RECEIPT['merchant']
+
+    # Item count only ever grows
+    counts = [len(s.get('items', [])) for s in snapshots]
+    assert counts == sorted(counts)
+
+    assert parser.result == RECEIPT
+
+    print("SUCCESS: Streaming parser verification passed!")
+
+if __name__ == "__main__":
+    test_incremental_parser()
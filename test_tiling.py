@@ -0,0 +1,108 @@
+import io
+import os
+from PIL import Image
+import ocr_processor
+from ocr_processor import split_into_tiles, merge_tile_results, process_image
+
+def test_split_into_tiles():
+    # A long warehouse receipt: 400px wide, 3000px tall
+    buf = io.BytesIO()
+    Image.new('RGB', (400, 3000), 'white').save(buf, format='JPEG')
+
+    tiles = split_into_tiles(buf.getvalue())
+    print(f"Tiles: {len(tiles)}")
+    assert len(tiles) > 1
+
+    sizes = [Image.open(io.BytesIO(tile)).size for tile in tiles]
+    print("Tile sizes:", sizes)
+    assert all(width == 400 for width, _ in sizes)
+    # Overlapping tiles cover more than the original height
+    assert sum(height for _, height in sizes) > 3000
+
+    # A normal receipt photo is left alone
+    buf = io.BytesIO()
+    Image.new('RGB', (3024, 4032), 'white').save(buf, format='JPEG')
+    assert len(split_into_tiles(buf.getvalue())) == 1
+
+    # A long receipt photographed sideways: stored 3000x400, EXIF says rotate 90 degrees
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    Image.new('RGB', (3000, 400), 'white').save(buf, format='JPEG', exif=exif)
+    tiles = split_into_tiles(buf.getvalue())
+    assert len(tiles) > 1
+    assert all(Image.open(io.BytesIO(tile)).size[0] == 400 for tile in tiles)
+
+def test_merge_tile_results():
+    results = [
+        {
+            'merchant': 'Costco',
+            'date': '2024-03-02',
+            'currency': 'USD',
+            'items': [
+                {'name': 'Milk', 'price': 3.99},
+                {'name': 'Milk', 'price': 3.99},
+                {'name': 'Eggs 24ct', 'price': 6.49},
+            ]
+        },
+        {
+            # Later tiles may guess header fields; they must be ignored
+            'merchant': 'Wrong',
+            'items': [
+                {'name': 'EGGS 24CT', 'price': 6.49},  # Overlap with tile 1
+                {'name': 'Bread', 'price': 2.00},
+            ]
+        },
+        {
+            'items': [
+                {'name': 'Bread', 'price': 2.00},  # Overlap with tile 2
+                {'name': 'Bread', 'price': 2.00},  # Second loaf, genuinely bought
+            ]
+        },
+    ]
+
+    merged = merge_tile_results(results)
+    print("Merged:", merged)
+    assert merged['merchant'] == 'Costco'
+    assert merged['date'] == '2024-03-02'
+    assert [item['name'] for item in merged['items']] == ['Milk', 'Milk', 'Eggs 24ct', 'Bread', 'Bread']
+
+    # A top tile that replied with something other than an object
+    merged = merge_tile_results([[{'name': 'Milk', 'price': 3.99}], {'items': [{'name': 'Bread', 'price': 2.00}]}])
+    assert merged['items'] == [{'name': 'Bread', 'price': 2.00}]
+
+def test_failed_tile_falls_back_to_whole_image():
+    buf = io.BytesIO()
+    Image.new('RGB', (400, 3000), 'white').save(buf, format='JPEG')
+
+    def flaky_gemini(tile, prompt):
+        if prompt == ocr_processor.ITEMS_TILE_PROMPT:
+            raise RuntimeError("429 Resource has been exhausted")
+        return {'merchant': 'Costco', 'items': [{'name': 'Milk', 'price': 3.99}]}
+
+    whole_image = []
+    def stub_route_image(image_bytes, on_progress=None):
+        whole_image.append(image_bytes)
+        return {'merchant': 'Costco', 'items': [{'name': 'Milk', 'price': 3.99}, {'name': 'Bread', 'price': 2.00}]}
+
+    original = ocr_processor._call_gemini, ocr_processor.route_image, os.environ.get("GEMINI_API_KEY")
+    ocr_processor._call_gemini = flaky_gemini
+    ocr_processor.route_image = stub_route_image
+    os.environ["GEMINI_API_KEY"] = original[2] or "test"
+    try:
+        data = process_image(buf.getvalue(), tiled=True)
+    finally:
+        ocr_processor._call_gemini, ocr_processor.route_image = original[:2]
+        if original[2] is None:
+            del os.environ["GEMINI_API_KEY"]
+
+    print("Fallback:", data)
+    assert whole_image == [buf.getvalue()]
+    assert len(data['items']) == 2
+
+    print("SUCCESS: Tiling verification passed!")
+
+if __name__ == "__main__":
+    test_split_into_tiles()
+    test_merge_tile_results()
+    test_failed_tile_falls_back_to_whole_image()